@@ -20,8 +20,12 @@
 Client Tkinter Kyberium - messagerie privée 1-to-1, sans salle
 """
 import asyncio
+import collections
+import concurrent.futures
+import hashlib
 import json
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import websockets
@@ -30,6 +34,27 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from kyberium.api.session import SessionManager
 
+ENCRYPTED_MESSAGE_FIELDS = ("encrypted_data", "nonce", "signature", "sign_key_id", "session_id")
+# Durée (secondes) pendant laquelle les messages envoyés sur une session que nous
+# venons d'initier sont conservés, pour un renvoi si notre handshake est écarté
+UNCONFIRMED_RETENTION = 10.0
+# Nombre maximal de messages conservés pour un renvoi après départage perdu
+MAX_UNCONFIRMED_MESSAGES = 20
+
+
+def key_fingerprint(public_key):
+    """Identifiant compact (SHA3-256 tronqué, 8 octets) d'une clé publique"""
+    return hashlib.sha3_256(public_key).digest()[:8].hex()
+
+
+def initiator_wins(own_sign_public, peer_sign_public):
+    """
+    Départage de deux handshakes croisés : seul celui de l'utilisateur dont la
+    clé de signature a la plus petite empreinte est conservé, des deux côtés.
+    """
+    return hashlib.sha3_256(own_sign_public).digest() < hashlib.sha3_256(peer_sign_public).digest()
+
+
 class KyberiumTkSimpleClient:
     def __init__(self, root):
         self.root = root
@@ -46,11 +71,33 @@ class KyberiumTkSimpleClient:
         self.username = ""
         self.kem_keypair = None
         self.sign_keypair = None
-        self.session_self = None  # Session principale pour l'enregistrement
         
         # Données de session
         self.contacts = {}  # username -> {kem_public, sign_public}
         self.sessions = {}  # username -> SessionManager
+        self.peer_sign_keys = {}  # username -> clé de signature épinglée au handshake
+        # Un verrou par session : le thread Tk (envoi) et le thread WebSocket
+        # (réception) ne doivent jamais faire avancer le même ratchet en même temps,
+        # mais des sessions différentes restent indépendantes
+        self.session_locks = {}  # username -> threading.RLock
+        self.session_ids = {}  # username -> empreinte du kem_ciphertext de la session retenue
+        self.last_msg_nums = {}  # username -> dernier msg_num déchiffré avec succès
+        # Contacts dont notre handshake_init n'est pas encore confirmé (aucun message
+        # reçu sur cette session) : un handshake_init croisé est alors départagé.
+        # Ne dépend pas du temps, pour que les deux côtés prennent la même décision
+        self.pending_handshakes = set()
+        # username -> messages envoyés sur une session que nous venons d'initier
+        # (renvoyés si notre handshake perd le départage), conservés au plus
+        # UNCONFIRMED_RETENTION secondes après l'envoi du handshake_init
+        self.unconfirmed_messages = {}
+        self.handshake_sent_at = {}  # username -> instant d'envoi de notre handshake_init
+        # (username, motif) -> nombre de messages rejetés ; une seule notice
+        # par contact et par motif, pour qu'un flot de messages invalides ne
+        # sature pas la file de l'interface
+        self.rejected_messages = collections.Counter()
+        # Un seul thread d'envoi : les msg_num partent dans l'ordre de saisie
+        self.send_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="kyberium-send")
+        self.closing = False  # fenêtre en cours de fermeture : plus d'envoi ni de rappel UI
         self.active_contact = None
         
         # Interface utilisateur
@@ -59,6 +106,72 @@ class KyberiumTkSimpleClient:
         # Générer les clés au démarrage
         self.generate_keys()
 
+    def session_lock(self, username):
+        """
+        Retourne le verrou dédié à la session avec ce contact.
+        Jamais pris sur le thread Tk, et aucun appel à root.after sous ce verrou :
+        un appel Tk depuis un autre thread attend la boucle principale.
+        """
+        return self.session_locks.setdefault(username, threading.RLock())
+
+    def post_ui(self, callback):
+        """Planifie une mise à jour de l'interface depuis le thread d'envoi"""
+        if self.closing:
+            return
+        try:
+            self.root.after(0, callback)
+        except (tk.TclError, RuntimeError):
+            # La racine Tk a été détruite entre-temps
+            pass
+
+    def forget_unconfirmed(self, contact):
+        """Oublie les messages conservés pour un éventuel renvoi vers ce contact"""
+        self.unconfirmed_messages.pop(contact, None)
+        self.handshake_sent_at.pop(contact, None)
+
+    def forget_handshake(self, contact):
+        """Abandonne tout départage et tout renvoi en attente avec ce contact"""
+        self.pending_handshakes.discard(contact)
+        self.forget_unconfirmed(contact)
+
+    def expire_unconfirmed(self, contact, sent_at):
+        """
+        Efface les messages conservés pour un handshake donné (thread du minuteur).
+        Si le contact n'a toujours pas utilisé la session, l'expéditeur est prévenu
+        que leur réception n'est pas confirmée.
+        """
+        with self.session_lock(contact):
+            if self.handshake_sent_at.get(contact) != sent_at:
+                return
+            unconfirmed = self.unconfirmed_messages.get(contact, [])
+            self.forget_unconfirmed(contact)
+        if unconfirmed:
+            contents = " | ".join(message_data["content"] for message_data in unconfirmed)
+            self.post_ui(lambda: self.add_system_message(
+                f"Réception non confirmée par {contact} ({len(unconfirmed)} message(s)) : {contents}"
+            ))
+
+    def install_session(self, contact, session, peer_sign_public, kem_ciphertext):
+        """Retient la session avec un contact (sous le verrou de session)"""
+        self.sessions[contact] = session
+        self.peer_sign_keys[contact] = peer_sign_public
+        self.session_ids[contact] = key_fingerprint(kem_ciphertext)
+        self.last_msg_nums.pop(contact, None)
+
+    def encrypt_on_session(self, contact, message_data):
+        """
+        Chiffre un message sur la session retenue et retourne ses champs (sous le
+        verrou de session). Tant que notre handshake n'est pas confirmé, le
+        message est conservé pour un éventuel renvoi.
+        """
+        encrypted_result = self.sessions[contact].triple_ratchet_encrypt(
+            json.dumps(message_data).encode('utf-8')
+        )
+        unconfirmed = self.unconfirmed_messages.get(contact)
+        if unconfirmed is not None and len(unconfirmed) < MAX_UNCONFIRMED_MESSAGES:
+            unconfirmed.append(message_data)
+        return self.encrypted_fields(encrypted_result, self.session_ids[contact])
+
     def generate_keys(self):
         """Génère les clés KEM et de signature pour cet utilisateur"""
         from kyberium.kem.kyber import Kyber1024
@@ -171,11 +284,8 @@ class KyberiumTkSimpleClient:
             messagebox.showerror("Erreur", "Veuillez entrer un nom d'utilisateur")
             return
         
-        # Créer la session principale avec les clés déjà générées
-        self.session_self = SessionManager(use_triple_ratchet=True)
-        # Utiliser les clés générées au démarrage au lieu d'en générer de nouvelles
-        self.session_self.own_keypair = self.kem_keypair
-        self.session_self.own_sign_keypair = self.sign_keypair
+        # L'enregistrement n'a besoin que des clés publiques générées au démarrage :
+        # aucune SessionManager (et donc aucune génération de clés) n'est créée ici
         
         # Démarrer le thread WebSocket
         self.websocket_thread = threading.Thread(target=self.websocket_worker, daemon=True)
@@ -195,7 +305,12 @@ class KyberiumTkSimpleClient:
         self.active_contact = None
         self.contacts = {}
         self.sessions = {}
-        self.session_self = None
+        self.peer_sign_keys = {}
+        self.session_ids = {}
+        self.last_msg_nums = {}
+        self.pending_handshakes = set()
+        self.unconfirmed_messages = {}
+        self.handshake_sent_at = {}
 
     def websocket_worker(self):
         # Créer une nouvelle boucle d'événements pour ce thread
@@ -211,18 +326,18 @@ class KyberiumTkSimpleClient:
                 self.connected = True
                 self.root.after(0, lambda: self.update_status(True))
                 # Enregistrement auprès du serveur
-                if self.session_self:
+                if self.kem_keypair and self.sign_keypair:
                     register_msg = {
                         "type": "register",
                         "username": self.username,
-                        "kem_public": self.session_self.get_public_key().hex(),
-                        "sign_public": self.session_self.get_sign_public_key().hex()
+                        "kem_public": self.kem_keypair[0].hex(),
+                        "sign_public": self.sign_keypair[0].hex()
                     }
                     await websocket.send(json.dumps(register_msg))
                     self.root.after(0, lambda: self.set_controls_state(True))
                     await self.listen_for_messages()
                 else:
-                    self.root.after(0, lambda: self.add_system_message("Erreur: Session non initialisée"))
+                    self.root.after(0, lambda: self.add_system_message("Erreur: Clés non générées"))
         except Exception as e:
             error_msg = str(e)
             self.root.after(0, lambda: self.add_system_message(f"Erreur de connexion: {error_msg}"))
@@ -239,7 +354,9 @@ class KyberiumTkSimpleClient:
                     message = await self.websocket.recv()
                     data = json.loads(message)
                     if data.get("type") == "user_list":
-                        self.root.after(0, lambda: self.update_contacts(data.get("users", [])))
+                        users = data.get("users", [])
+                        self.set_contacts(users)
+                        self.root.after(0, lambda users=users: self.update_contacts(users))
                     elif data.get("type") == "handshake_init":
                         await self.handle_handshake_init(data)
                     elif data.get("type") == "handshake_response":
@@ -256,8 +373,27 @@ class KyberiumTkSimpleClient:
             error_msg = str(e)
             self.root.after(0, lambda: self.add_system_message(f"Erreur fatale de réception: {error_msg}"))
 
+    def set_contacts(self, users):
+        """
+        Applique la liste des utilisateurs reçue du serveur (thread WebSocket).
+        Le serveur diffuse cette liste avant de relayer les messages d'un client
+        qui vient de s'enregistrer : un contact parti, ou revenu avec d'autres
+        clés, est donc oublié avant que son handshake_init ne soit traité.
+        """
+        contacts = {
+            user["username"]: {"kem_public": user["kem_public"], "sign_public": user["sign_public"]}
+            for user in users
+        }
+        # Un contact parti (ou revenu avec d'autres clés) n'a pas pu recevoir notre
+        # handshake en cours : plus de départage ni de renvoi possible
+        for username, keys in self.contacts.items():
+            if contacts.get(username) != keys:
+                with self.session_lock(username):
+                    self.forget_handshake(username)
+        self.contacts = contacts
+
     def update_contacts(self, users):
-        """Met à jour la liste des contacts et préserve la sélection active"""
+        """Met à jour la liste affichée et préserve la sélection active (thread Tk)"""
         current_selection = None
         if self.contacts_list.size() > 0:
             selection = self.contacts_list.curselection()
@@ -265,13 +401,8 @@ class KyberiumTkSimpleClient:
                 current_selection = self.contacts_list.get(selection[0])
         
         self.contacts_list.delete(0, tk.END)
-        self.contacts = {}
         for user in users:
             username = user["username"]
-            self.contacts[username] = {
-                "kem_public": user["kem_public"],
-                "sign_public": user["sign_public"]
-            }
             self.contacts_list.insert(tk.END, username)
             
             # Restaurer la sélection si c'était l'utilisateur actif
@@ -306,45 +437,75 @@ class KyberiumTkSimpleClient:
         self.messages_text.delete(1.0, tk.END)
         self.messages_text.config(state=tk.DISABLED)
         
-        # Initier le handshake si nécessaire
+        # Le handshake n'est plus initié à la sélection : il part avec le premier
+        # message (0-RTT), ce qui évite aussi des opérations PQ pour un simple clic
         if username not in self.sessions:
-            self.initiate_handshake(username)
+            self.add_system_message(f"La session chiffrée avec {username} sera établie avec le premier message")
         else:
             self.add_system_message(f"Session chiffrée déjà établie avec {username}")
 
-    def initiate_handshake(self, contact):
-        """Initie un handshake Triple Ratchet avec un contact"""
-        if contact not in self.contacts:
-            self.add_system_message(f"Impossible d'initier le handshake avec {contact}")
-            return
+    def initiate_handshake(self, contact, peer_keys, first_message_data=None):
+        """
+        Initie un handshake Triple Ratchet avec un contact.
+        peer_keys est l'instantané {kem_public, sign_public} du contact pris sur le
+        thread Tk. Si first_message_data est fourni, il est chiffré sous la chaîne
+        d'envoi initiale et transporté dans le même message handshake_init (0-RTT).
+        Appelé sous le verrou de session du contact ; ne touche pas à l'interface.
+        """
         
         # Créer une nouvelle session pour l'initiateur avec les clés du client
         session = SessionManager(use_triple_ratchet=True)
         session.own_keypair = self.kem_keypair
         session.own_sign_keypair = self.sign_keypair
         
-        peer_kem_pub = bytes.fromhex(self.contacts[contact]["kem_public"])
-        peer_sign_pub = bytes.fromhex(self.contacts[contact]["sign_public"])
+        peer_kem_pub = bytes.fromhex(peer_keys["kem_public"])
+        peer_sign_pub = bytes.fromhex(peer_keys["sign_public"])
         session.set_peer_public_key(peer_kem_pub)
         session.set_peer_sign_public_key(peer_sign_pub)
         
         # Initialiser le Triple Ratchet (côté initiateur)
         handshake = session.triple_ratchet_init(peer_kem_pub, peer_sign_pub)
-        self.sessions[contact] = session
-        
-        handshake_msg = {
-            "type": "handshake_init",
-            "to": contact,
-            "kem_ciphertext": handshake["kem_ciphertext"].hex(),
-            "kem_signature": handshake["kem_signature"].hex(),
-            "sign_public_key": handshake["sign_public_key"].hex()
-        }
+        with self.session_lock(contact):
+            self.install_session(contact, session, peer_sign_pub, handshake["kem_ciphertext"])
+            self.pending_handshakes.add(contact)
+            self.unconfirmed_messages[contact] = []
+            sent_at = time.monotonic()
+            self.handshake_sent_at[contact] = sent_at
+            
+            handshake_msg = {
+                "type": "handshake_init",
+                "to": contact,
+                "kem_ciphertext": handshake["kem_ciphertext"].hex(),
+                "kem_signature": handshake["kem_signature"].hex(),
+                "sign_public_key": handshake["sign_public_key"].hex()
+            }
+            if first_message_data is not None:
+                handshake_msg["first_message"] = self.encrypt_on_session(contact, first_message_data)
+            self.transmit(handshake_msg)
+        # Les messages conservés sont effacés au bout de UNCONFIRMED_RETENTION
+        # secondes, par un minuteur hors du thread Tk
+        expiry = threading.Timer(UNCONFIRMED_RETENTION, self.expire_unconfirmed, args=(contact, sent_at))
+        expiry.daemon = True
+        expiry.start()
+
+    def transmit(self, frame):
+        """Confie un message JSON à la boucle WebSocket (appelable depuis tout thread)"""
         if self.websocket and self.websocket_loop:
             asyncio.run_coroutine_threadsafe(
-                self.websocket.send(json.dumps(handshake_msg)),
+                self.websocket.send(json.dumps(frame)),
                 self.websocket_loop
             )
-        self.add_system_message(f"Handshake initié avec {contact}")
+
+    def encrypted_fields(self, encrypted_result, session_id):
+        """Champs transmis pour un message chiffré par le Triple Ratchet"""
+        return {
+            "encrypted_data": encrypted_result["ciphertext"].hex(),
+            "nonce": encrypted_result["nonce"].hex(),
+            "signature": encrypted_result["signature"].hex(),
+            "msg_num": encrypted_result["msg_num"],
+            "sign_key_id": key_fingerprint(encrypted_result["sign_public_key"]),
+            "session_id": session_id
+        }
 
     async def handle_handshake_init(self, data):
         """Gère la réception d'un handshake initié par un autre utilisateur"""
@@ -353,55 +514,141 @@ class KyberiumTkSimpleClient:
         kem_signature = bytes.fromhex(data["kem_signature"])
         sign_public_key = bytes.fromhex(data["sign_public_key"])
         
-        # Créer une nouvelle session pour le répondeur avec les clés du client
-        session = SessionManager(use_triple_ratchet=True)
-        session.own_keypair = self.kem_keypair
-        session.own_sign_keypair = self.sign_keypair
-        
         peer_kem_pub = bytes.fromhex(self.contacts[from_user]["kem_public"])
         peer_sign_pub = bytes.fromhex(self.contacts[from_user]["sign_public"])
-        session.set_peer_public_key(peer_kem_pub)
-        session.set_peer_sign_public_key(peer_sign_pub)
+        # Un premier message joint à un handshake rejeté ou en échec est perdu :
+        # le destinataire en est prévenu (pas en cas de départage, il sera renvoyé)
+        lost = " ; le message joint est perdu" if isinstance(data.get("first_message"), dict) else ""
+        if sign_public_key != peer_sign_pub:
+            self.root.after(0, lambda: self.add_system_message(f"Handshake de {from_user} rejeté : clé de signature différente de celle enregistrée{lost}"))
+            return
         
-        # Compléter le handshake (côté répondeur)
-        try:
-            success = session.triple_ratchet_complete_handshake(
-                kem_ciphertext, kem_signature, sign_public_key
-            )
-            if not success:
-                self.add_system_message(f"Échec du handshake avec {from_user}")
-                return
-        except Exception as e:
-            self.add_system_message(f"Erreur lors du handshake avec {from_user}: {e}")
+        # Départage, handshake et installation sous un même verrou : l'état de
+        # notre propre handshake ne peut pas changer entre la décision et son effet
+        notices = []
+        success = False
+        with self.session_lock(from_user):
+            # Handshakes croisés : notre handshake_init n'est pas encore confirmé.
+            # Le départage utilise la clé épinglée à l'enregistrement, pas celle
+            # annoncée dans le message. Un seul handshake croisé est écarté : s'il
+            # en arrive un autre, le contact n'a pas pu retenir le nôtre
+            if from_user in self.pending_handshakes and initiator_wins(self.sign_keypair[0], peer_sign_pub):
+                self.pending_handshakes.discard(from_user)
+                notices.append(f"Handshakes simultanés avec {from_user} : le nôtre est conservé")
+            else:
+                # Créer une nouvelle session pour le répondeur avec les clés du client
+                session = SessionManager(use_triple_ratchet=True)
+                session.own_keypair = self.kem_keypair
+                session.own_sign_keypair = self.sign_keypair
+                session.set_peer_public_key(peer_kem_pub)
+                session.set_peer_sign_public_key(peer_sign_pub)
+                
+                # Compléter le handshake (côté répondeur)
+                try:
+                    success = session.triple_ratchet_complete_handshake(
+                        kem_ciphertext, kem_signature, sign_public_key
+                    )
+                    if not success:
+                        notices.append(f"Échec du handshake avec {from_user}{lost}")
+                except Exception as e:
+                    notices.append(f"Erreur lors du handshake avec {from_user}: {e}{lost}")
+            if success:
+                # Notre handshake perdant est abandonné : ses messages sont renvoyés
+                # sur la session retenue, dans l'ordre et avant tout envoi en file
+                # (le thread d'envoi attend ce verrou)
+                to_resend = self.unconfirmed_messages.get(from_user, []) if from_user in self.pending_handshakes else []
+                self.forget_handshake(from_user)
+                self.install_session(from_user, session, sign_public_key, kem_ciphertext)
+                for message_data in to_resend:
+                    self.transmit({
+                        "type": "encrypted_message",
+                        "to": from_user,
+                        **self.encrypt_on_session(from_user, message_data)
+                    })
+                notices.append(f"Session chiffrée établie avec {from_user}")
+        for notice in notices:
+            self.root.after(0, lambda notice=notice: self.add_system_message(notice))
+        if not success:
             return
-            
-        self.sessions[from_user] = session
-        self.add_system_message(f"Session chiffrée établie avec {from_user}")
+        
+        # Premier message transporté dans le handshake (0-RTT)
+        first_message = data.get("first_message")
+        if isinstance(first_message, dict):
+            await self.handle_encrypted_message(dict(first_message, **{"from": from_user}))
 
     async def handle_handshake_response(self, data):
         """Gère la réponse à un handshake (normalement pas utilisé dans ce protocole)"""
         from_user = data.get("from")
-        self.add_system_message(f"Réponse de handshake reçue de {from_user} (ignorée)")
+        self.root.after(0, lambda: self.add_system_message(f"Réponse de handshake reçue de {from_user} (ignorée)"))
+
+    def precheck_encrypted_message(self, from_user, data):
+        """
+        Contrôles peu coûteux avant la vérification Dilithium.
+        Retourne le motif de rejet, ou None si le message peut être déchiffré.
+        """
+        if any(not isinstance(data.get(field), str) for field in ENCRYPTED_MESSAGE_FIELDS):
+            return "header"
+        msg_num = data.get("msg_num")
+        if not isinstance(msg_num, int) or isinstance(msg_num, bool) or msg_num < 0:
+            return "header"
+        # Message chiffré sur une autre session (handshake écarté par le départage)
+        if data["session_id"] != self.session_ids.get(from_user):
+            return "session"
+        sign_public_key = self.peer_sign_keys.get(from_user)
+        if sign_public_key is None or data["sign_key_id"] != key_fingerprint(sign_public_key):
+            return "key_id"
+        # Le ratchet déchiffre strictement dans l'ordre (pas de clés sautées) :
+        # seul le msg_num suivant peut réussir
+        last_msg_num = self.last_msg_nums.get(from_user)
+        expected = 0 if last_msg_num is None else last_msg_num + 1
+        if msg_num < expected:
+            return "replay"
+        if msg_num > expected:
+            return "gap"
+        return None
+
+    def reject_message(self, from_user, reason):
+        """Comptabilise un message rejeté ; seul le premier rejet par motif est signalé"""
+        self.rejected_messages[(from_user, reason)] += 1
+        if self.rejected_messages[(from_user, reason)] == 1:
+            self.root.after(0, lambda: self.add_system_message(
+                f"Message de {from_user} rejeté ({reason}) ; les rejets suivants pour ce motif ne seront plus signalés"
+            ))
 
     async def handle_encrypted_message(self, data):
         """Gère la réception d'un message chiffré"""
         from_user = data.get("from")
-        session = self.sessions.get(from_user)
-        if not session:
-            self.add_system_message(f"Aucune session chiffrée avec {from_user}")
+        if from_user not in self.sessions:
+            self.reject_message(from_user, "no_session")
             return
             
         try:
-            ciphertext = bytes.fromhex(data["encrypted_data"])
-            nonce = bytes.fromhex(data["nonce"])
-            signature = bytes.fromhex(data["signature"])
-            msg_num = data["msg_num"]
-            sign_public_key = bytes.fromhex(data["sign_public_key"])
-            
-            # Déchiffrer le message avec Triple Ratchet
-            decrypted = session.triple_ratchet_decrypt(
-                ciphertext, nonce, signature, msg_num, sign_public_key
-            )
+            with self.session_lock(from_user):
+                # Rejet rapide (en-tête, session, identifiant de clé, msg_num hors séquence)
+                # avant de payer le décodage et la vérification Dilithium
+                reason = self.precheck_encrypted_message(from_user, data)
+                if not reason:
+                    ciphertext = bytes.fromhex(data["encrypted_data"])
+                    nonce = bytes.fromhex(data["nonce"])
+                    signature = bytes.fromhex(data["signature"])
+                    msg_num = data["msg_num"]
+                    # La clé de signature n'est plus transmise : on utilise la clé
+                    # épinglée lors du handshake, déjà confrontée à sign_key_id
+                    sign_public_key = self.peer_sign_keys[from_user]
+                    session = self.sessions[from_user]
+                    
+                    # Déchiffrer le message avec Triple Ratchet
+                    decrypted = session.triple_ratchet_decrypt(
+                        ciphertext, nonce, signature, msg_num, sign_public_key
+                    )
+                    if decrypted:
+                        self.last_msg_nums[from_user] = msg_num
+                        # Le contact utilise bien cette session : plus de départage possible
+                        self.forget_handshake(from_user)
+            # Notice postée hors du verrou de session
+            if reason:
+                self.reject_message(from_user, reason)
+                return
             if decrypted:
                 try:
                     message_data = json.loads(decrypted.decode())
@@ -449,50 +696,72 @@ class KyberiumTkSimpleClient:
         if not self.active_contact:
             self.add_system_message("Veuillez sélectionner un destinataire dans la liste des utilisateurs.")
             return
-        if self.active_contact not in self.sessions:
-            self.add_system_message("Session chiffrée non établie avec ce contact. Veuillez patienter...")
-            return
             
         message = self.message_entry.get().strip()
         if not message:
             return
             
-        session = self.sessions[self.active_contact]
         message_data = {
             "content": message,
             "sender": self.username
         }
+        # Instantané des clés du contact pris sur le thread Tk : update_contacts
+        # peut reconstruire self.contacts pendant que le thread d'envoi travaille
+        peer_keys = dict(self.contacts[self.active_contact]) if self.active_contact in self.contacts else None
+        self.message_entry.delete(0, tk.END)
         
+        # Le chiffrement (signature Dilithium comprise) part sur le thread d'envoi :
+        # l'interface reste réactive et le message k+1 est signé pendant que le
+        # message k est transmis par la boucle WebSocket
+        self.send_executor.submit(self.encrypt_and_send, self.active_contact, message_data, peer_keys)
+
+    def encrypt_and_send(self, contact, message_data, peer_keys=None):
+        """Chiffre un message puis le confie au transport (thread d'envoi)"""
+        if self.closing:
+            # Messages encore en file à la fermeture : abandonnés
+            return
         try:
-            # Chiffrer le message avec Triple Ratchet
-            encrypted_result = session.triple_ratchet_encrypt(
-                json.dumps(message_data).encode('utf-8')
-            )
-            
-            encrypted_msg = {
-                "type": "encrypted_message",
-                "to": self.active_contact,
-                "encrypted_data": encrypted_result["ciphertext"].hex(),
-                "nonce": encrypted_result["nonce"].hex(),
-                "signature": encrypted_result["signature"].hex(),
-                "msg_num": encrypted_result["msg_num"],
-                "sign_public_key": encrypted_result["sign_public_key"].hex()
-            }
-            
-            if self.websocket and self.websocket_loop:
-                asyncio.run_coroutine_threadsafe(
-                    self.websocket.send(json.dumps(encrypted_msg)),
-                    self.websocket_loop
-                )
-            self.add_message(self.username, message)
-            self.message_entry.delete(0, tk.END)
-            
+            with self.session_lock(contact):
+                if contact in self.sessions:
+                    # Chiffrer le message avec Triple Ratchet
+                    self.transmit({
+                        "type": "encrypted_message",
+                        "to": contact,
+                        **self.encrypt_on_session(contact, message_data)
+                    })
+                    status = "sent"
+                elif peer_keys is not None:
+                    # Pas encore de session : le message part dans le handshake_init
+                    self.initiate_handshake(contact, peer_keys, message_data)
+                    status = "handshake"
+                else:
+                    status = "unknown"
         except Exception as e:
-            self.add_system_message(f"Erreur lors du chiffrement: {e}")
+            error_msg = str(e)
+            content = message_data["content"]
+            self.post_ui(lambda: self.add_system_message(
+                f"Message non envoyé à {contact} (erreur lors du chiffrement: {error_msg}) : {content}"
+            ))
+            return
+        
+        # Notices postées hors du verrou de session
+        if status == "unknown":
+            content = message_data["content"]
+            self.post_ui(lambda: self.add_system_message(
+                f"Message non envoyé à {contact} (contact inconnu) : {content}"
+            ))
+            return
+        if status == "handshake":
+            self.post_ui(lambda: self.add_system_message(f"Handshake initié avec {contact}"))
+        self.post_ui(lambda: self.add_message(self.username, message_data["content"]))
 
     def on_closing(self):
+        # Les envois en file sont abandonnés et le thread d'envoi ne touche plus
+        # à l'interface une fois la racine Tk détruite
+        self.closing = True
         if self.connected:
             self.disconnect_from_server()
+        self.send_executor.shutdown(wait=False)
         self.root.destroy()
 
 def main():
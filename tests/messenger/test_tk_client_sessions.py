@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Tests de la logique de session du client Tkinter (verrous, rejet rapide, départage)
+
+Le client est chargé avec un SessionManager factice : seule la logique propre au
+messenger est testée ici, pas la cryptographie Kyberium.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+CLIENT_PATH = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..', 'messenger_app', 'kyberium_tk_simple_client.py'
+))
+
+
+class FakeSessionManager:
+    """
+    Ratchet factice strictement ordonné : une session est identifiée par son
+    kem_ciphertext, et tout msg_num inattendu ou toute autre session échoue.
+    """
+
+    def __init__(self, use_triple_ratchet=True):
+        self.own_keypair = None
+        self.own_sign_keypair = None
+        self.session_id = None
+        self.send_n = 0
+        self.recv_n = 0
+        self.decrypt_calls = 0
+
+    def set_peer_public_key(self, public_key):
+        self.peer_public_key = public_key
+
+    def set_peer_sign_public_key(self, public_key):
+        self.peer_sign_public_key = public_key
+
+    def triple_ratchet_init(self, peer_kem_public, peer_sign_public):
+        self.session_id = os.urandom(16)
+        return {
+            "kem_ciphertext": self.session_id,
+            "kem_signature": b"kem-signature",
+            "sign_public_key": self.own_sign_keypair[0],
+        }
+
+    def triple_ratchet_complete_handshake(self, kem_ciphertext, kem_signature, sign_public_key):
+        self.session_id = kem_ciphertext
+        return True
+
+    def triple_ratchet_encrypt(self, plaintext):
+        # Lecture / écriture séparées : une mise à jour perdue serait détectée
+        msg_num = self.send_n
+        time.sleep(0)
+        self.send_n = msg_num + 1
+        return {
+            "ciphertext": plaintext,
+            "nonce": self.session_id,
+            "signature": b"signature",
+            "msg_num": msg_num,
+            "sign_public_key": self.own_sign_keypair[0],
+        }
+
+    def triple_ratchet_decrypt(self, ciphertext, nonce, signature, msg_num, sign_public_key):
+        self.decrypt_calls += 1
+        if nonce != self.session_id or msg_num != self.recv_n:
+            raise ValueError("désynchronisation")
+        expected = self.recv_n
+        time.sleep(0)
+        self.recv_n = expected + 1
+        return ciphertext
+
+
+def load_client_module():
+    """Charge le client avec le SessionManager factice, sans polluer sys.modules"""
+    session_module = types.ModuleType("kyberium.api.session")
+    session_module.SessionManager = FakeSessionManager
+    stubs = {
+        "kyberium": types.ModuleType("kyberium"),
+        "kyberium.api": types.ModuleType("kyberium.api"),
+        "kyberium.api.session": session_module,
+    }
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        # Le transport réseau n'est pas exercé par ces tests
+        stubs["websockets"] = types.ModuleType("websockets")
+    saved = {name: sys.modules.get(name) for name in stubs}
+    saved_path = list(sys.path)
+    sys.modules.update(stubs)
+    try:
+        spec = importlib.util.spec_from_file_location("kyberium_tk_simple_client_under_test", CLIENT_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path[:] = saved_path
+        for name, previous in saved.items():
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+    return module
+
+
+client_module = load_client_module()
+
+
+class FakeRoot:
+    """
+    Racine Tk factice : les rappels immédiats sont exécutés sur place. Un vrai
+    root.after appelé d'un autre thread attend la boucle Tk : il ne doit jamais
+    l'être sous un verrou de session.
+    """
+
+    def __init__(self):
+        self.timers = []
+        self.client = None
+
+    def title(self, *args):
+        pass
+
+    def geometry(self, *args):
+        pass
+
+    def after(self, delay, callback):
+        if self.client is not None:
+            assert not any(lock._is_owned() for lock in list(self.client.session_locks.values()))
+        if delay == 0:
+            callback()
+        else:
+            self.timers.append((delay, callback))
+
+    def destroy(self):
+        pass
+
+
+class Relay:
+    """Serveur factice : range chaque message dans la boîte du destinataire"""
+
+    def __init__(self):
+        self.clients = {}
+
+    def register(self, client):
+        self.clients[client.username] = client
+        self.broadcast()
+
+    def unregister(self, client):
+        del self.clients[client.username]
+        self.broadcast()
+
+    def broadcast(self):
+        """Diffuse la liste des utilisateurs, comme le serveur à chaque (dés)inscription"""
+        users = [
+            {"username": c.username,
+             "kem_public": c.kem_keypair[0].hex(),
+             "sign_public": c.sign_keypair[0].hex()}
+            for c in self.clients.values()
+        ]
+        for c in self.clients.values():
+            c.set_contacts([u for u in users if u["username"] != c.username])
+
+    def deliver(self, sender, frame):
+        relay = dict(frame)
+        relay["from"] = sender.username
+        self.clients[frame["to"]].inbox.append(relay)
+
+
+class HarnessClient(client_module.KyberiumTkSimpleClient):
+    """Client sans interface graphique, relié à un Relay"""
+
+    def __init__(self, username, relay):
+        self.relay = relay
+        self.displayed = []
+        self.system_messages = []
+        self.inbox = []
+        super().__init__(FakeRoot())
+        self.root.client = self
+        self.username = username
+        self.connected = True
+        relay.register(self)
+
+    def setup_ui(self):
+        pass
+
+    def generate_keys(self):
+        self.kem_keypair = (os.urandom(32), b"kem-private")
+        self.sign_keypair = (os.urandom(32), b"sign-private")
+
+    def add_message(self, sender, message):
+        self.displayed.append((sender, message))
+
+    def add_message_with_notification(self, sender, message, from_user):
+        self.displayed.append((sender, message))
+
+    def add_system_message(self, message):
+        self.system_messages.append(message)
+
+    def transmit(self, frame):
+        self.relay.deliver(self, frame)
+
+    def send(self, contact, content):
+        """Équivalent synchrone de send_message (sans passer par le thread d'envoi)"""
+        peer_keys = dict(self.contacts[contact]) if contact in self.contacts else None
+        self.encrypt_and_send(contact, {"content": content, "sender": self.username}, peer_keys)
+
+    def process_inbox(self):
+        """Traite les messages reçus dans l'ordre d'arrivée"""
+        loop = asyncio.new_event_loop()
+        try:
+            while self.inbox:
+                frame = self.inbox.pop(0)
+                if frame["type"] == "handshake_init":
+                    loop.run_until_complete(self.handle_handshake_init(frame))
+                elif frame["type"] == "encrypted_message":
+                    loop.run_until_complete(self.handle_encrypted_message(frame))
+        finally:
+            loop.close()
+
+    def received_from(self, contact):
+        return [content for sender, content in self.displayed if sender == contact]
+
+
+def test_concurrent_sessions_stress():
+    """N threads d'envoi × M sessions : aucun message perdu, désordonné ou corrompu"""
+    relay = Relay()
+    alice = HarnessClient("alice", relay)
+    peers = [HarnessClient(f"peer{i}", relay) for i in range(8)]
+    n_threads, n_messages = 6, 25
+
+    # Établir les sessions (handshake 0-RTT)
+    for peer in peers:
+        alice.send(peer.username, "hello")
+        peer.process_inbox()
+
+    # Chaque contact répond en continu pendant qu'Alice envoie depuis plusieurs threads
+    replies = {peer.username: [] for peer in peers}
+    for peer in peers:
+        for k in range(n_messages):
+            peer.send("alice", f"reply-{k}")
+        replies[peer.username] = list(alice.inbox)
+        alice.inbox.clear()
+
+    errors = []
+
+    def sender(thread_id):
+        try:
+            for k in range(n_messages):
+                for peer in peers:
+                    alice.encrypt_and_send(peer.username, {"content": f"t{thread_id}-m{k}", "sender": "alice"})
+        except Exception as e:
+            errors.append(e)
+
+    def receiver(contact):
+        loop = asyncio.new_event_loop()
+        try:
+            for frame in replies[contact]:
+                loop.run_until_complete(alice.handle_encrypted_message(frame))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            loop.close()
+
+    threads = [threading.Thread(target=sender, args=(t,)) for t in range(n_threads)]
+    threads += [threading.Thread(target=receiver, args=(peer.username,)) for peer in peers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    for peer in peers:
+        # Côté contact : tout est déchiffré, dans l'ordre des msg_num
+        msg_nums = [frame["msg_num"] for frame in peer.inbox]
+        assert msg_nums == list(range(1, 1 + n_threads * n_messages))
+        peer.process_inbox()
+        alice_messages = peer.received_from("alice")
+        assert len(alice_messages) == 1 + n_threads * n_messages
+        assert sorted(alice_messages[1:]) == sorted(
+            f"t{t}-m{k}" for t in range(n_threads) for k in range(n_messages)
+        )
+        # Messages d'un même thread : ordre d'envoi conservé
+        for t in range(n_threads):
+            own = [m for m in alice_messages if m.startswith(f"t{t}-")]
+            assert own == [f"t{t}-m{k}" for k in range(n_messages)]
+        # Côté Alice : toutes les réponses reçues, dans l'ordre
+        assert alice.received_from(peer.username) == [f"reply-{k}" for k in range(n_messages)]
+        assert alice.sessions[peer.username].send_n == 1 + n_threads * n_messages
+    assert not alice.rejected_messages
+
+
+def establish(initiator, responder, content="hello"):
+    """Établit une session par un handshake 0-RTT et le livre au répondeur"""
+    initiator.send(responder.username, content)
+    responder.process_inbox()
+
+
+def next_frame(sender, recipient, content):
+    """Chiffre un message sans le livrer : retourne la trame telle que reçue"""
+    sender.send(recipient.username, content)
+    return recipient.inbox.pop()
+
+
+def test_precheck_reasons():
+    """Chaque contrôle rapide retourne son motif, sans appel au ratchet"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    establish(alice, bob)
+    frame = next_frame(alice, bob, "m1")
+    decrypt_calls = bob.sessions["alice"].decrypt_calls
+
+    assert bob.precheck_encrypted_message("alice", frame) is None
+    for field in client_module.ENCRYPTED_MESSAGE_FIELDS:
+        broken = dict(frame)
+        del broken[field]
+        assert bob.precheck_encrypted_message("alice", broken) == "header"
+    for msg_num in ("1", True, -1, None):
+        assert bob.precheck_encrypted_message("alice", dict(frame, msg_num=msg_num)) == "header"
+    assert bob.precheck_encrypted_message("alice", dict(frame, sign_key_id="00" * 8)) == "key_id"
+    assert bob.precheck_encrypted_message("alice", dict(frame, session_id="00" * 8)) == "session"
+    assert bob.precheck_encrypted_message("carol", frame) == "session"
+    # Premier message (msg_num 0) déjà déchiffré : seul 1 est attendu
+    assert bob.precheck_encrypted_message("alice", dict(frame, msg_num=0)) == "replay"
+    assert bob.precheck_encrypted_message("alice", dict(frame, msg_num=2)) == "gap"
+    assert bob.sessions["alice"].decrypt_calls == decrypt_calls
+
+
+def test_precheck_fresh_session_expects_zero():
+    """Sur une session neuve, seul msg_num 0 est accepté"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    alice.send("bob", "hello")
+    handshake = bob.inbox[0]
+    first = dict(handshake["first_message"], **{"from": "alice"})
+    bob.process_inbox()
+    bob.last_msg_nums.pop("alice")
+    assert bob.precheck_encrypted_message("alice", first) is None
+    assert bob.precheck_encrypted_message("alice", dict(first, msg_num=1)) == "gap"
+
+
+def test_rejections_counted_and_reported_once():
+    """Les rejets sont comptés par contact et par motif, signalés une seule fois"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    carol = HarnessClient("carol", relay)
+    establish(alice, bob)
+    frame = next_frame(alice, bob, "m1")
+    bob.inbox.append(frame)
+    bob.process_inbox()
+    decrypt_calls = bob.sessions["alice"].decrypt_calls
+
+    bob.inbox.extend([dict(frame)] * 5)
+    bob.inbox.extend([dict(frame, msg_num=7)] * 3)
+    bob.process_inbox()
+    # Message d'un contact sans session avec nous
+    relay.deliver(carol, dict(frame, to="bob"))
+    bob.process_inbox()
+
+    assert bob.rejected_messages == {
+        ("alice", "replay"): 5,
+        ("alice", "gap"): 3,
+        ("carol", "no_session"): 1,
+    }
+    assert bob.sessions["alice"].decrypt_calls == decrypt_calls
+    notices = [m for m in bob.system_messages if "rejeté" in m]
+    assert len(notices) == 3
+    assert bob.received_from("alice") == ["hello", "m1"]
+
+
+def crossed_pair():
+    """Deux clients et leur départage : (gagnant, perdant)"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    if client_module.initiator_wins(alice.sign_keypair[0], bob.sign_keypair[0]):
+        return relay, alice, bob
+    return relay, bob, alice
+
+
+def test_initiator_wins_is_antisymmetric():
+    """Pour deux clés distinctes, exactement un côté gagne le départage"""
+    for _ in range(50):
+        a, b = os.urandom(32), os.urandom(32)
+        assert client_module.initiator_wins(a, b) != client_module.initiator_wins(b, a)
+        assert not client_module.initiator_wins(a, a)
+
+
+def test_crossed_handshakes_keep_one_session():
+    """Handshakes croisés : une seule session survit, les messages renvoyés restent ordonnés"""
+    relay, winner, loser = crossed_pair()
+    loser.send(winner.username, "l1")
+    loser.send(winner.username, "l2")
+    loser.send(winner.username, "l3")
+    winner.send(loser.username, "w1")
+
+    # Un envoi déjà en file sur le thread d'envoi du perdant pendant le départage
+    gate = threading.Event()
+    loser.send_executor.submit(gate.wait)
+    queued = loser.send_executor.submit(
+        loser.encrypt_and_send, winner.username, {"content": "l4", "sender": loser.username}
+    )
+    loser.process_inbox()
+    gate.set()
+    queued.result(timeout=5)
+
+    winner.process_inbox()
+    assert winner.session_ids[loser.username] == loser.session_ids[winner.username]
+    assert winner.received_from(loser.username) == ["l1", "l2", "l3", "l4"]
+    assert loser.received_from(winner.username) == ["w1"]
+    # Les messages de la session écartée sont rejetés avant tout déchiffrement
+    assert winner.rejected_messages == {(loser.username, "session"): 2}
+    assert winner.sessions[loser.username].decrypt_calls == 4
+    assert not winner.pending_handshakes and not loser.pending_handshakes
+    assert not winner.unconfirmed_messages and not loser.unconfirmed_messages
+
+    winner.send(loser.username, "w2")
+    loser.process_inbox()
+    assert loser.received_from(winner.username) == ["w1", "w2"]
+
+
+def test_only_one_crossed_handshake_is_dropped():
+    """Un second handshake du contact signifie qu'il n'a pas retenu le nôtre : il est accepté"""
+    relay, winner, loser = crossed_pair()
+    winner.send(loser.username, "w1")
+    loser.send(winner.username, "l1")
+    winner.process_inbox()
+    assert winner.sessions[loser.username].session_id != loser.sessions[winner.username].session_id
+
+    # Le perdant n'a jamais pu compléter notre handshake et recommence
+    loser.inbox.clear()
+    loser.sessions.pop(winner.username)
+    loser.send(winner.username, "l2")
+    winner.process_inbox()
+    assert winner.session_ids[loser.username] == loser.session_ids[winner.username]
+    assert winner.received_from(loser.username) == ["l2"]
+
+
+def test_rejoined_contact_handshake_accepted(monkeypatch):
+    """Un contact revenu avec de nouvelles clés n'a pas reçu notre handshake : le sien est accepté"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    monkeypatch.setattr(client_module, "initiator_wins", lambda own, peer: own == alice.sign_keypair[0])
+    alice.send("bob", "perdu")
+    relay.unregister(bob)
+    assert "bob" not in alice.pending_handshakes
+
+    bob = HarnessClient("bob", relay)
+    bob.send("alice", "de retour")
+    alice.process_inbox()
+    assert alice.received_from("bob") == ["de retour"]
+    alice.send("bob", "bienvenue")
+    bob.process_inbox()
+    assert bob.received_from("alice") == ["bienvenue"]
+
+
+def test_rejected_handshake_reports_lost_first_message(monkeypatch):
+    """Un handshake rejeté ou en échec signale la perte du message qu'il transportait"""
+    relay = Relay()
+    alice, bob = HarnessClient("alice", relay), HarnessClient("bob", relay)
+    alice.send("bob", "hello")
+    frame = bob.inbox.pop()
+    bob.inbox.append(dict(frame, sign_public_key=os.urandom(32).hex()))
+    bob.process_inbox()
+    assert any("rejeté" in m and "perdu" in m for m in bob.system_messages)
+
+    bob.inbox.append(frame)
+    monkeypatch.setattr(FakeSessionManager, "triple_ratchet_complete_handshake", lambda self, *args: False)
+    bob.process_inbox()
+    assert any(m.startswith("Échec du handshake") and "perdu" in m for m in bob.system_messages)
+    assert "alice" not in bob.sessions
+    assert bob.received_from("alice") == []
+
+
+def test_unconfirmed_messages_reported_at_expiry():
+    """Sans réponse du contact, l'expéditeur est prévenu à l'expiration de la conservation"""
+    relay = Relay()
+    alice, bob, carol = (HarnessClient(name, relay) for name in ("alice", "bob", "carol"))
+    alice.send("bob", "hello")
+    alice.send("bob", "encore")
+    alice.expire_unconfirmed("bob", alice.handshake_sent_at["bob"])
+    assert alice.system_messages[-1] == "Réception non confirmée par bob (2 message(s)) : hello | encore"
+    assert "bob" not in alice.unconfirmed_messages
+
+    # Réception confirmée par une réponse sur la session : rien à signaler
+    alice.send("carol", "hello")
+    carol.process_inbox()
+    carol.send("alice", "reçu")
+    sent_at = alice.handshake_sent_at["carol"]
+    alice.process_inbox()
+    notices = len(alice.system_messages)
+    alice.expire_unconfirmed("carol", sent_at)
+    assert len(alice.system_messages) == notices